@@ -1,51 +1,81 @@
 #!/usr/bin/env python3
 
-from litex.soc.integration.builder import *
-from litex.soc.integration.soc_core import *
-from litex_boards.platforms import digilent_arty
-from migen import *
+import argparse
+import os
+
+from litex.soc.integration.builder import Builder
+from litex.soc.integration.soc_core import SoCCore, SoCMini
+from migen import (
+    FSM,
+    Case,
+    ClockDomain,
+    Display,
+    If,
+    Module,
+    Mux,
+    NextState,
+    NextValue,
+    Signal,
+)
+
+from litelitedram.cache import cached_build, package_sources
+from litelitedram.utils import fsm_edge_signals
 
 
 class Example(Module):
-    def __init__(self):
+    def __init__(self, trace=False):
         self.clock_domains += ClockDomain("sys")
         self.s = Signal()
-        self.counter = Signal(8)
-        x = Array(Signal(name="a") for i in range(7))
+        self.trace = Signal()
+        self.comb += self.trace.eq(trace)
+        x = [Signal(name=f"a{i}") for i in range(7)]
+        self.counter = Signal(max=len(x))
 
         myfsm = FSM()
         self.submodules += myfsm
 
-        myfsm.act("FOO", Display("FOO norm"), self.s.eq(1), NextState("BAR"))
+        myfsm.act("FOO", If(self.trace, Display("FOO norm")), self.s.eq(1), NextState("BAR"))
         myfsm.act(
             "BAR",
-            Display("BAR norm"),
+            If(self.trace, Display("BAR norm")),
             self.s.eq(0),
-            NextValue(self.counter, self.counter + 1),
-            NextValue(x[self.counter], 89),
+            NextValue(self.counter, Mux(self.counter == len(x) - 1, 0, self.counter + 1)),
+            Case(self.counter, {i: NextValue(x[i], 89) for i in range(len(x))}),
             NextState("FOO"),
         )
 
-        self.be = myfsm.before_entering("FOO")
-        self.ae = myfsm.after_entering("FOO")
-        self.bl = myfsm.before_leaving("FOO")
-        self.al = myfsm.after_leaving("FOO")
+        self.be, self.ae, self.bl, self.al = fsm_edge_signals(myfsm, "FOO")
 
 
 class BareSoC(SoCCore):
-    def __init__(self, sys_clk_freq=int(50e6)):
+    def __init__(self, sys_clk_freq=int(50e6), trace_fsm=False):
+        from litex_boards.platforms import digilent_arty
+
         platform = digilent_arty.Platform()
 
         # SoCMini ----------------------------------------------------------------------------------
-        SoCMini.__init__(self, platform, clk_freq=100_000_000, ident="bare", ident_version=False)
+        ident = "" if os.environ.get("LITEX_NO_IDENT") else "bare"
+        SoCMini.__init__(self, platform, clk_freq=100_000_000, ident=ident, ident_version=False)
+
+        self.submodules.example = Example(trace=trace_fsm)
+
+
+def main(build_dir=None, argv=None):
+    parser = argparse.ArgumentParser(description="litelitedram bare FSM example")
+    parser.add_argument("--trace-fsm", action="store_true", help="Print the FSM state every cycle")
+    args = parser.parse_args(argv)
 
-        self.submodules.example = Example()
+    if build_dir is None:
+        build_dir = os.path.join("build", "digilent_arty")
 
+    def build():
+        soc = BareSoC(trace_fsm=args.trace_fsm)
+        builder = Builder(soc, output_dir=build_dir)
+        builder.build(run=False)
+        return soc
 
-def main():
-    soc = BareSoC()
-    builder = Builder(soc)
-    builder.build(run=False)
+    extra = (args.trace_fsm, os.environ.get("LITEX_NO_IDENT"))
+    return cached_build(build, build_dir, [__file__, *package_sources()], extra)
 
 
 if __name__ == "__main__":
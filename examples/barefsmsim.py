@@ -3,14 +3,18 @@
 # Copyright (c) 2022 Jevin Sweval <jevinsweval@gmail.com>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import os
+
 from litex.build.generic_platform import *
 from litex.build.sim import SimPlatform
 from litex.build.sim.config import SimConfig
 from litex.gen.fhdl.sim import *
-from litex.soc.integration.builder import *
-from litex.soc.integration.soc_core import *
-from migen import *
-from rich import print
+from litex.soc.integration.builder import Builder
+from litex.soc.integration.soc_core import SoCCore, SoCMini, soc_core_argdict
+from migen import FSM, Case, Display, If, Module, Mux, NextState, NextValue, Signal
+
+from litelitedram.cache import cached_build, package_sources
+from litelitedram.utils import fsm_edge_signals
 
 # IOs ----------------------------------------------------------------------------------------------
 
@@ -22,28 +26,27 @@ _io = [
 
 
 class Example(Module):
-    def __init__(self):
+    def __init__(self, trace=False):
         # self.clock_domains += ClockDomain("sys")
         self.s = Signal()
-        self.counterz = Signal(8)
-        x = Array(Signal(name="a") for i in range(7))
+        self.trace = Signal()
+        self.comb += self.trace.eq(trace)
+        x = [Signal(name=f"a{i}") for i in range(7)]
+        self.counterz = Signal(max=len(x))
 
         self.submodules.myfsm = myfsm = FSM()
 
-        myfsm.act("FOO", Display("FOO norm"), self.s.eq(1), NextState("BAR"))
+        myfsm.act("FOO", If(self.trace, Display("FOO norm")), self.s.eq(1), NextState("BAR"))
         myfsm.act(
             "BAR",
-            Display("BAR norm"),
+            If(self.trace, Display("BAR norm")),
             self.s.eq(0),
-            NextValue(self.counterz, self.counterz + 1),
-            NextValue(x[self.counterz], 89),
+            NextValue(self.counterz, Mux(self.counterz == len(x) - 1, 0, self.counterz + 1)),
+            Case(self.counterz, {i: NextValue(x[i], 89) for i in range(len(x))}),
             NextState("FOO"),
         )
 
-        self.be = myfsm.before_entering("FOO")
-        self.ae = myfsm.after_entering("FOO")
-        self.bl = myfsm.before_leaving("FOO")
-        self.al = myfsm.after_leaving("FOO")
+        self.be, self.ae, self.bl, self.al = fsm_edge_signals(myfsm, "FOO")
 
 
 # Bench SoC ----------------------------------------------------------------------------------------
@@ -58,21 +61,24 @@ class SimSoC(SoCCore):
     def __init__(
         self,
         sys_clk_freq=None,
+        trace_fsm=False,
         **kwargs,
     ):
         platform = Platform()
         sys_clk_freq = int(sys_clk_freq)
 
+        ident = "" if os.environ.get("LITEX_NO_IDENT") else "litelitedram sim"
+
         # SoCCore ----------------------------------------------------------------------------------
         SoCMini.__init__(
             self,
             platform,
             clk_freq=sys_clk_freq,
-            ident="litelitedram sim",
+            ident=ident,
             **kwargs,
         )
 
-        self.submodules.example = Example()
+        self.submodules.example = Example(trace=trace_fsm)
 
         # CRG --------------------------------------------------------------------------------------
         self.submodules.crg = CRG(platform.request("sys_clk"))
@@ -82,12 +88,14 @@ class SimSoC(SoCCore):
 # Main ---------------------------------------------------------------------------------------------
 
 
-def main():
+def main(build_dir=None, argv=None):
     from litex.soc.integration.soc import LiteXSoCArgumentParser
 
     parser = LiteXSoCArgumentParser(description="litelitedram sim")
     parser.set_platform(SimPlatform)
-    args = parser.parse_args()
+    parser.add_argument("--trace-fsm", action="store_true", help="Print the FSM state every cycle")
+    parser.set_defaults(jobs=os.cpu_count(), threads=max(1, os.cpu_count() // 2), opt_level="O3")
+    args = parser.parse_args(argv)
 
     sys_clk_freq = int(100e6)
 
@@ -98,13 +106,34 @@ def main():
     soc_kwargs["cpu_type"] = "None"
     soc_kwargs["with_uart"] = False
     soc_kwargs["ident_version"] = False
-
-    soc = SimSoC(**soc_kwargs)
+    soc_kwargs["trace_fsm"] = args.trace_fsm
 
     builder_argdict = parser.builder_argdict
-
-    builder = Builder(soc, **builder_argdict)
-    builder.build(build=True, run=False, sim_config=sim_config, **parser.toolchain_argdict)
+    if build_dir is not None:
+        builder_argdict["output_dir"] = build_dir
+    elif builder_argdict["output_dir"] is None:
+        builder_argdict["output_dir"] = os.path.join("build", "barefsmsim")
+    toolchain_argdict = parser.toolchain_argdict
+    toolchain_argdict["trace_fst"] = True
+
+    def build():
+        soc = SimSoC(**soc_kwargs)
+        builder = Builder(soc, **builder_argdict)
+        builder.build(build=True, run=False, sim_config=sim_config, **toolchain_argdict)
+        return soc
+
+    return cached_build(
+        build,
+        builder_argdict["output_dir"],
+        [__file__, *package_sources()],
+        extra=(
+            sorted(soc_kwargs.items()),
+            sorted(builder_argdict.items()),
+            sorted(toolchain_argdict.items()),
+            sim_config.modules,
+            os.environ.get("LITEX_NO_IDENT"),
+        ),
+    )
 
 
 if __name__ == "__main__":
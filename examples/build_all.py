@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2022 Jevin Sweval <jevinsweval@gmail.com>
+# SPDX-License-Identifier: BSD-2-Clause
+
+import argparse
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+EXAMPLES = ("barefsm", "barefsmsim", "deca")
+
+
+def _run_example(name, build_root):
+    example = importlib.import_module(name)
+    build_dir = os.path.join(build_root, name)
+    example.main(build_dir=build_dir, argv=[])
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build all litelitedram examples in parallel")
+    parser.add_argument("--build-root", default="build", help="Base output directory")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of workers")
+    parser.add_argument("examples", nargs="*", default=EXAMPLES, help="Examples to build")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=ctx) as ex:
+        futures = [ex.submit(_run_example, name, args.build_root) for name in args.examples]
+        for future in futures:
+            print(f"built {future.result()}")
+
+
+if __name__ == "__main__":
+    main()
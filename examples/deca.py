@@ -6,17 +6,11 @@
 
 import os
 
-from litex.soc.cores.clock import *
 from litex.soc.cores.led import LedChaser
-from litex.soc.integration.builder import *
-from litex.soc.integration.soc_core import *
-from litex.soc.interconnect import stream
-from litex.soc.interconnect.csr import *
-from litex_boards.platforms import terasic_deca
-from litex_boards.targets.terasic_deca import _CRG
-from migen import *
+from litex.soc.integration.builder import Builder, builder_args
+from litex.soc.integration.soc_core import SoCCore, soc_core_argdict, soc_core_args
 
-from litelitedram.ddr3 import SlowDDR3
+from litelitedram.ddr3 import SlowDDR3, SlowDDR3BlackBox
 
 # Base SoC -----------------------------------------------------------------------------------------
 
@@ -27,17 +21,24 @@ class BaseSoC(SoCCore):
         with_jtagbone=False,
         with_uartbone=True,
         with_analyzer=True,
+        with_dram=True,
+        fast_elab=False,
         sys_clk_freq=int(100e6),
         **kwargs,
     ):
+        from litex_boards.platforms import terasic_deca
+        from litex_boards.targets.terasic_deca import _CRG
+
         platform = terasic_deca.Platform()
 
+        ident = "" if os.environ.get("LITEX_NO_IDENT") else "litelitedram example on on MAX10 DECA"
+
         # SoCCore ----------------------------------------------------------------------------------
         SoCCore.__init__(
             self,
             platform,
             clk_freq=sys_clk_freq,
-            ident="litelitedram example on on MAX10 DECA",
+            ident=ident,
             **kwargs,
         )
 
@@ -45,12 +46,14 @@ class BaseSoC(SoCCore):
         self.submodules.crg = _CRG(platform, sys_clk_freq)
 
         # Slow DDR3 --------------------------------------------------------------------------------
-        ddr3_pads = platform.request("ddram")
-        self.submodules.ddr = SlowDDR3(self.platform, ddr3_pads, sys_clk_freq, debug=True)
-        dram_base = 0x2000_0000
-        self.add_memory_region("dram", dram_base, self.ddr.bitsize // 8, type="")
-        self.bus.add_slave("dram", self.ddr.bus)
-        # self.register_mem("dram", dram_base, self.ddr.bus, size=self.ddr.bitsize // 8)
+        if with_dram:
+            ddr3_pads = platform.request("ddram")
+            ddr_cls = SlowDDR3BlackBox if fast_elab else SlowDDR3
+            self.submodules.ddr = ddr_cls(self.platform, ddr3_pads, sys_clk_freq, debug=True)
+            dram_base = 0x2000_0000
+            self.add_memory_region("dram", dram_base, self.ddr.bitsize // 8, type="")
+            self.bus.add_slave("dram", self.ddr.bus)
+            # self.register_mem("dram", dram_base, self.ddr.bus, size=self.ddr.bitsize // 8)
 
         # JTAGbone ---------------------------------------------------------------------------------
         if with_jtagbone:
@@ -64,25 +67,36 @@ class BaseSoC(SoCCore):
         if with_analyzer:
             from litescope import LiteScopeAnalyzer
 
-            analyzer_signals = [
-                ddr3_pads.a,
-                ddr3_pads.ba,
-                ddr3_pads.cas_n,
-                ddr3_pads.ras_n,
-                ddr3_pads.we_n,
-                ddr3_pads.cs_n,
-                ddr3_pads.dm,
-                ddr3_pads.dq,
-                # ddr3_pads.dqs_p,
-                # self.ddr.init_state,
-                self.ddr.work_state,
-                # self.ddr.refresh_cnt,
-                # self.ddr.refresh_issued,
-                self.ddr.bus,
-                self.ddr.sysio,
-            ]
+            assert with_dram, "the analyzer only captures SlowDDR3 signals"
+
+            # One capture group per signal family: groups share the sample memory, so it is
+            # only as wide as the widest group rather than the sum of all of them.
+            analyzer_groups = {
+                # addr
+                0: [ddr3_pads.a, ddr3_pads.ba, self.ddr.work_state],
+                # ctl
+                1: [
+                    ddr3_pads.cas_n,
+                    ddr3_pads.ras_n,
+                    ddr3_pads.we_n,
+                    ddr3_pads.cs_n,
+                    self.ddr.work_state,
+                ],
+                # data
+                2: [ddr3_pads.dm, ddr3_pads.dq, self.ddr.work_state],
+                # bus
+                3: [self.ddr.bus, self.ddr.sysio],
+                # fsm
+                4: [
+                    # ddr3_pads.dqs_p,
+                    # self.ddr.init_state,
+                    self.ddr.work_state,
+                    # self.ddr.refresh_cnt,
+                    # self.ddr.refresh_issued,
+                ],
+            }
             self.submodules.analyzer = LiteScopeAnalyzer(
-                analyzer_signals,
+                analyzer_groups,
                 depth=4096,
                 clock_domain="sys",
                 rle_nbits_min=15,
@@ -98,7 +112,7 @@ class BaseSoC(SoCCore):
 # Main ---------------------------------------------------------------------------------------------
 
 
-def main():
+def main(build_dir=None, argv=None):
     from litex.soc.integration.soc import LiteXSoCArgumentParser
 
     parser = LiteXSoCArgumentParser(description="litelitedram example on on MAX10 DECA")
@@ -106,9 +120,15 @@ def main():
     target_group.add_argument("--build", action="store_true", help="Build bitstream")
     target_group.add_argument("--load", action="store_true", help="Load bitstream")
     target_group.add_argument("--with-analyzer", action="store_true", help="Enable litescope")
+    target_group.add_argument("--no-dram", action="store_true", help="Disable slowDDR3 controller")
+    target_group.add_argument(
+        "--rtl-only", action="store_true", help="Only write the top-level Verilog"
+    )
     builder_args(parser)
     soc_core_args(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.with_analyzer and args.no_dram:
+        parser.error("--with-analyzer only captures SlowDDR3 signals, drop --no-dram")
 
     soc_kwargs = soc_core_argdict(args)
     soc_kwargs["cpu_type"] = "None"
@@ -117,15 +137,27 @@ def main():
 
     soc = BaseSoC(
         with_analyzer=args.with_analyzer,
+        with_dram=not args.no_dram,
+        fast_elab=bool(os.environ.get("LITEDRAM_FAST_ELAB")),
         **soc_kwargs,
     )
-    builder = Builder(soc, csr_csv="csr.csv")
+    builder = Builder(soc, output_dir=build_dir, csr_csv="csr.csv")
+    if args.rtl_only:
+        # Builder.build() normally sets this, SlowDDR3 writes its sbt output under it.
+        soc.platform.output_dir = builder.output_dir
+        build_name = soc.get_build_name()
+        os.makedirs(builder.gateware_dir, exist_ok=True)
+        v_output = soc.platform.get_verilog(soc, name=build_name)
+        v_output.write(os.path.join(builder.gateware_dir, build_name + ".v"))
+        return soc
     builder.build(run=args.build, verbose=False)
 
     if args.load:
         prog = soc.platform.create_programmer()
         prog.load_bitstream(os.path.join(builder.gateware_dir, soc.build_name + ".sof"))
 
+    return soc
+
 
 if __name__ == "__main__":
     main()
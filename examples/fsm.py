@@ -1,50 +1,183 @@
 #!/usr/bin/env python3
 
+import os
+
 from litex.gen.fhdl import verilog
-from migen import *
+from migen import (
+    FSM,
+    Case,
+    ClockDomain,
+    Display,
+    DisplayOnEnter,
+    If,
+    Module,
+    Mux,
+    NextState,
+    NextValue,
+    Signal,
+)
+
+from litelitedram.cache import cached_convert, package_sources
+from litelitedram.utils import fsm_edge_signals, migen_obj_name, rename_migen_obj
 
 # from migen.fhdl import verilog
 
+_FILL = 89
+
 
 class Example(Module):
     def __init__(self):
         self.clock_domains += ClockDomain("sys")
         self.s = Signal()
-        self.counter = Signal(8)
-        x = Array(Signal(name="a") for i in range(7))
+        self.trace = Signal()
+        self.regs = x = [Signal(name=f"a{i}") for i in range(7)]
+        self.counter = Signal(max=len(x))
 
         myfsm = FSM()
         self.submodules += myfsm
 
         myfsm.act(
             "FOO",
-            Display("FOO norm"),
+            If(self.trace, Display("FOO norm")),
             DisplayOnEnter("FOO on enter"),
             self.s.eq(1),
             NextState("BAR"),
         )
         myfsm.act(
             "BAR",
-            Display("BAR norm"),
+            If(self.trace, Display("BAR norm")),
             DisplayOnEnter("BAR on enter"),
             self.s.eq(0),
-            NextValue(self.counter, self.counter + 1),
-            NextValue(x[self.counter], 89),
+            NextValue(self.counter, Mux(self.counter == len(x) - 1, 0, self.counter + 1)),
+            Case(self.counter, {i: NextValue(x[i], _FILL) for i in range(len(x))}),
             NextState("FOO"),
         )
 
-        self.be = myfsm.before_entering("FOO")
-        self.ae = myfsm.after_entering("FOO")
-        self.bl = myfsm.before_leaving("FOO")
-        self.al = myfsm.after_leaving("FOO")
+        self.be, self.ae, self.bl, self.al = fsm_edge_signals(myfsm, "FOO")
+        for name in ("be", "ae", "bl", "al"):
+            rename_migen_obj(getattr(self, name), name)
 
 
-if __name__ == "__main__":
-    example = Example()
-    print(
-        verilog.convert(
-            example,
-            {example.s, example.counter, example.be, example.ae, example.bl, example.al},
-            regular_comb=True,
+def _const(value, width):
+    return f"{width}'d{value & ((1 << width) - 1)}"
+
+
+def _reset(sig):
+    return _const(sig.reset.value, len(sig))
+
+
+def fsm_fast_emit(example):
+    s, trace, counter, be, ae, bl, al = (
+        migen_obj_name(sig)
+        for sig in (
+            example.s,
+            example.trace,
+            example.counter,
+            example.be,
+            example.ae,
+            example.bl,
+            example.al,
         )
     )
+    msb = len(example.counter) - 1
+    last = _const(len(example.regs) - 1, msb + 1)
+    regs = [(migen_obj_name(r), r) for r in example.regs]
+    writes = "\n".join(
+        f"\t\t\t{i}: {n} <= {_const(_FILL, len(r))};" for i, (n, r) in enumerate(regs)
+    )
+    decls = "\n".join(f"reg {n} = {_reset(r)};" for n, r in regs)
+    resets = "\n".join(f"\t\t{n} <= {_reset(r)};" for n, r in regs)
+    return f"""/* Machine-generated by fsm_fast_emit */
+
+module top(
+\toutput reg {s},
+\toutput reg [{msb}:0] {counter} = {_reset(example.counter)},
+\toutput reg {be},
+\toutput reg {ae} = {_reset(example.ae)},
+\toutput reg {bl},
+\toutput reg {al} = {_reset(example.al)},
+\tinput {trace},
+\tinput sys_clk,
+\tinput sys_rst
+);
+
+localparam FOO = 1'd0;
+localparam BAR = 1'd1;
+
+reg fsm_state = FOO;
+reg fsm_next_state;
+{decls}
+
+always @(*) begin
+\t{s} = 1'd0;
+\tfsm_next_state = fsm_state;
+\tcase (fsm_state)
+\t\tBAR: begin
+\t\t\tif ({trace})
+\t\t\t\t$display("BAR norm");
+\t\t\t{s} = 1'd0;
+\t\t\tfsm_next_state = FOO;
+\t\tend
+\t\tdefault: begin
+\t\t\tif ({trace})
+\t\t\t\t$display("FOO norm");
+\t\t\t{s} = 1'd1;
+\t\t\tfsm_next_state = BAR;
+\t\tend
+\tendcase
+end
+
+always @(*) begin
+\t{be} = (fsm_state != FOO) & (fsm_next_state == FOO);
+\t{bl} = (fsm_state == FOO) & (fsm_next_state != FOO);
+end
+
+always @(posedge sys_clk) begin
+\tif ((fsm_state != FOO) & (fsm_next_state == FOO))
+\t\t$display("FOO on enter");
+\tif ((fsm_state != BAR) & (fsm_next_state == BAR))
+\t\t$display("BAR on enter");
+\tfsm_state <= fsm_next_state;
+\t{ae} <= {be};
+\t{al} <= {bl};
+\tif (fsm_state == BAR) begin
+\t\t{counter} <= ({counter} == {last}) ? {msb + 1}'d0 : {counter} + 1'd1;
+\t\tcase ({counter})
+{writes}
+\t\tendcase
+\tend
+\tif (sys_rst) begin
+\t\tfsm_state <= FOO;
+\t\t{ae} <= {_reset(example.ae)};
+\t\t{al} <= {_reset(example.al)};
+\t\t{counter} <= {_reset(example.counter)};
+{resets}
+\tend
+end
+
+endmodule
+"""
+
+
+def convert():
+    example = Example()
+    return verilog.convert(
+        example,
+        {
+            example.s,
+            example.counter,
+            example.trace,
+            example.be,
+            example.ae,
+            example.bl,
+            example.al,
+        },
+        regular_comb=True,
+    )
+
+
+if __name__ == "__main__":
+    if os.environ.get("FAST_EMIT"):
+        print(fsm_fast_emit(Example()))
+    else:
+        print(cached_convert(convert, [__file__, *package_sources()]))
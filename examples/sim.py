@@ -3,22 +3,19 @@
 # Copyright (c) 2022 Jevin Sweval <jevinsweval@gmail.com>
 # SPDX-License-Identifier: BSD-2-Clause
 
-from typing import Generator
+import os
 
-from liteeth.phy.model import LiteEthPHYModel
-from litescope import LiteScopeAnalyzer
 from litex.build.generic_platform import *
 from litex.build.sim import SimPlatform
 from litex.build.sim.config import SimConfig
 from litex.gen.fhdl.sim import *
-from litex.soc.cores import uart
-from litex.soc.integration.builder import *
-from litex.soc.integration.soc_core import *
+from litex.soc.integration.builder import Builder
+from litex.soc.integration.soc_core import SoCCore, SoCMini, soc_core_argdict
 from litex.soc.interconnect import wishbone
 from migen import *
 from migen.fhdl.structure import _Statement
-from rich import print
 
+from litelitedram.cache import cached_build, package_sources, stamped_build, use_ccache
 from litelitedram.ddr3 import SlowDDR3
 from litelitedram.ddr3_model import DDR3Model, DDR3PhyInterface
 from litelitedram.utils import (
@@ -78,8 +75,6 @@ class Platform(SimPlatform):
 
 class WBRegister(Module):
     def __init__(self, width, addr_width=16, registered=True) -> None:
-        from litex.soc.interconnect import wishbone
-
         self.d = d = Signal(width)
         self.q = q = Signal(width)
         self.a = a = Signal(addr_width)
@@ -88,21 +83,13 @@ class WBRegister(Module):
         ack = Signal()
         dat_r = Signal.like(bus.dat_r)
 
-        # fmt: off
         self.comb += [
-            d.eq(q),
             wb_valid.eq(bus.cyc & bus.stb),
-            If(wb_valid,
-                a.eq(bus.adr),
-                ack.eq(1),
-                If(bus.we,
-                    d.eq(bus.dat_w),
-                ).Else(
-                    dat_r.eq(q),
-                ),
-            ),
+            a.eq(Mux(wb_valid, bus.adr, 0)),
+            ack.eq(wb_valid),
+            d.eq(Mux(wb_valid & bus.we, bus.dat_w, q)),
+            dat_r.eq(Mux(wb_valid & ~bus.we, q, 0)),
         ]
-        # fmt: on
 
         self.sync += q.eq(d)
 
@@ -135,6 +122,10 @@ def TimeoutCheck(tries):
 
 
 class WBInterface(wishbone.Interface):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._default_sel = (1 << len(self.sel)) - 1
+
     def controller_write_hdl(
         self,
         fsm: FSM,
@@ -145,33 +136,27 @@ class WBInterface(wishbone.Interface):
         cti: Signal | int | None = None,
         bte: Signal | int | None = None,
         tries: Signal | None = None,
-    ) -> Generator[_Statement, None, None]:
+    ) -> list[_Statement]:
         if sel is None:
-            sel = 2 ** len(self.sel) - 1
-
-        timeout_check = list(TimeoutCheck(tries)) if tries is not None else []
-
-        def statements():
-            for s in timeout_check:
-                yield s
-            yield self.adr.eq(adr)
-            yield self.dat_w.eq(dat)
-            yield self.sel.eq(sel)
-            if cti is not None:
-                yield self.cti.eq(cti)
-            if bte is not None:
-                yield self.bte.eq(bte)
-            yield self.we.eq(1)
-            yield self.cyc.eq(1)
-            yield self.stb.eq(1)
-            yield If(
+            sel = self._default_sel
+
+        stmts = list(TimeoutCheck(tries)) if tries is not None else []
+        stmts += [self.adr.eq(adr), self.dat_w.eq(dat), self.sel.eq(sel)]
+        if cti is not None:
+            stmts.append(self.cti.eq(cti))
+        if bte is not None:
+            stmts.append(self.bte.eq(bte))
+        stmts += [
+            self.we.eq(1),
+            self.cyc.eq(1),
+            self.stb.eq(1),
+            If(
                 self.ack,
-                Display(next_state + "_BUS_ACKED"),
+                Display(f"{next_state}_BUS_ACKED"),
                 NextState(next_state),
-            )
-
-        for s in statements():
-            yield s
+            ),
+        ]
+        return stmts
 
     def controller_read_hdl(
         self,
@@ -183,91 +168,80 @@ class WBInterface(wishbone.Interface):
         cti: Signal | int | None = None,
         bte: Signal | int | None = None,
         tries: Signal | None = None,
-    ) -> Generator[_Statement, None, None]:
+    ) -> list[_Statement]:
         if sel is None:
-            sel = 2 ** len(self.sel) - 1
-
-        timeout_check = list(TimeoutCheck(tries)) if tries is not None else []
-
-        def statements():
-            for s in timeout_check:
-                yield s
-            yield self.adr.eq(adr)
-            yield self.sel.eq(sel)
-            if cti is not None:
-                yield self.cti.eq(cti)
-            if bte is not None:
-                yield self.bte.eq(bte)
-            yield self.we.eq(0)
-            yield self.cyc.eq(1)
-            yield self.stb.eq(1)
-            yield If(
+            sel = self._default_sel
+
+        stmts = list(TimeoutCheck(tries)) if tries is not None else []
+        stmts += [self.adr.eq(adr), self.sel.eq(sel)]
+        if cti is not None:
+            stmts.append(self.cti.eq(cti))
+        if bte is not None:
+            stmts.append(self.bte.eq(bte))
+        stmts += [
+            self.we.eq(0),
+            self.cyc.eq(1),
+            self.stb.eq(1),
+            If(
                 self.ack,
-                Display(next_state + "_BUS_ACKED"),
+                Display(f"{next_state}_BUS_ACKED"),
                 NextValue(dat, self.dat_r),
                 NextState(next_state),
-            )
-
-        for s in statements():
-            yield s
+            ),
+        ]
+        return stmts
 
 
 class WBRegisterTester(Module):
-    def __init__(self, test_addr) -> None:
+    def __init__(self, test_addr, with_timeout=False) -> None:
         self.bus = bus = WBInterface()
         self.submodules.fsm = fsm = FSM("START")
         self.tmp = tmp = Signal(bus.data_width)
-        self.tries = tries = Signal(8)
 
-        self.sync += tries.eq(tries + 1)
+        if with_timeout:
+            self.tries = tries = Signal(8)
+            self.sync += tries.eq(tries + 1)
+            self.sync += list(TimeoutCheck(tries))
 
         magic = 0xDEAD_BEEF
 
         # fmt: off
         fsm.act("START",
-            *TimeoutCheck(tries),
             DisplayOnEnter("START"),
             NextState("WRITE")
         )
         fsm.act("WRITE",
-            *TimeoutCheck(tries),
             DisplayOnEnter("WRITE"),
             Display("%0t WRITE tmp: %0x", Time(), tmp),
-            *bus.controller_write_hdl(fsm, "READ", test_addr, magic, tries=tries),
+            *bus.controller_write_hdl(fsm, "READ", test_addr, magic),
         )
         fsm.act("READ",
-            *TimeoutCheck(tries),
             DisplayOnEnter("READ"),
             Display("%0t READ tmp: %0x", Time(), tmp),
-            *bus.controller_read_hdl(fsm, "READ_CHECK", test_addr, tmp, tries=tries),
+            *bus.controller_read_hdl(fsm, "READ_CHECK", test_addr, tmp),
         )
         fsm.act("READ_CHECK",
-            *TimeoutCheck(tries),
             DisplayOnEnter("READ_CHECK"),
             Display("%0t READ_CHECK tmp: %0x", Time(), tmp),
             *Assert(tmp == magic),
             NextState("WRITE_PLUS_ONE"),
         )
         fsm.act("WRITE_PLUS_ONE",
-            *TimeoutCheck(tries),
             DisplayOnEnter("WRITE_PLUS_ONE"),
-            *bus.controller_write_hdl(fsm, "READ_PLUS_ONE", test_addr, tmp + 1, tries=tries),
+            *bus.controller_write_hdl(fsm, "READ_PLUS_ONE", test_addr, tmp + 1),
         )
         fsm.act("READ_PLUS_ONE",
-            *TimeoutCheck(tries),
             DisplayOnEnter("READ_PLUS_ONE"),
             Display("READ_PLUS_ONE tmp: %0x", tmp),
-            *bus.controller_read_hdl(fsm, "READ_PLUS_ONE_CHECK", test_addr, tmp, tries=tries),
+            *bus.controller_read_hdl(fsm, "READ_PLUS_ONE_CHECK", test_addr, tmp),
         )
         fsm.act("READ_PLUS_ONE_CHECK",
-            *TimeoutCheck(tries),
             DisplayOnEnter("READ_PLUS_ONE_CHECK"),
             Display("READ_PLUS_ONE_CHECK tmp: %0x", tmp),
             *Assert(tmp == magic + 1),
             NextState("END"),
         )
         fsm.act("END",
-            *TimeoutCheck(tries),
             DisplayOnEnter("END"),
             # Finish()
         )
@@ -284,23 +258,28 @@ class SimSoC(SoCCore):
         self,
         sys_clk_freq=None,
         with_analyzer=False,
+        analyzer_depth=512,
+        analyzer_scope="default",
         with_etherbone=False,
         with_uartbone=False,
         with_dram=False,
+        with_monitors=False,
         trace=False,
+        trace_dram_init=False,
+        debug_soc_gen=False,
         **kwargs,
     ):
         platform = Platform()
         sys_clk_freq = int(sys_clk_freq)
 
-        self.comb += platform.trace.eq(trace)
+        ident = "" if os.environ.get("LITEX_NO_IDENT") else "litelitedram sim"
 
         # SoCCore ----------------------------------------------------------------------------------
         SoCMini.__init__(
             self,
             platform,
             clk_freq=sys_clk_freq,
-            ident="litelitedram sim",
+            ident=ident,
             **kwargs,
         )
 
@@ -309,12 +288,16 @@ class SimSoC(SoCCore):
 
         # Etherbone --------------------------------------------------------------------------------
         if with_etherbone:
+            from liteeth.phy.model import LiteEthPHYModel
+
             eth_pads = self.platform.request("eth")
             self.submodules.ethphy = LiteEthPHYModel(eth_pads)
             self.add_etherbone(phy=self.ethphy, ip_address="192.168.42.50")
 
         # UARTbone ---------------------------------------------------------------------------------
         if with_uartbone:
+            from litex.soc.cores import uart
+
             uart_pads = platform.request("uartbone")
             self.submodules.uartbone_phy = uart.RS232PHYModel(uart_pads)
             self.submodules.uartbone = uart.UARTBone(phy=self.uartbone_phy, clk_freq=sys_clk_freq)
@@ -329,9 +312,13 @@ class SimSoC(SoCCore):
             self.bus.add_slave("dram", self.ddr.bus)
             self.submodules.ddr_model = DDR3Model(self.platform, ddr3_pads)
             # self.register_mem("dram", dram_base, self.ddr.bus, size=self.ddr.bitsize // 8)
+            if not trace_dram_init:
+                # DDR3 init is tens of thousands of idle cycles, only start dumping once it is done.
+                trace = trace & self.ddr.sysio.initfin
+        self.comb += platform.trace.eq(trace)
 
         if not with_dram:
-            self.submodules.wb_reg32 = WBRegister(32)
+            self.submodules.wb_reg32 = WBRegister(32, registered=False)
             wb_reg32_base = 0x3000_0000
             self.add_memory_region("wb_reg32", wb_reg32_base, 8, type="")
             self.bus.add_slave("wb_reg32", self.wb_reg32.bus)
@@ -341,35 +328,32 @@ class SimSoC(SoCCore):
             # self.add_memory_region("wb_reg16", wb_reg16_base, 8, type="")
             # self.bus.add_slave("wb_reg16", self.wb_reg16.bus)
 
-            self.submodules.wb_reg_tester = WBRegisterTester(wb_reg32_base // 4)
-            self.bus.add_master("wb_reg_tester", self.wb_reg_tester.bus)
-
-            self.submodules.sys_clk_counter = Cycles()
-            cyc = MonitorArg(self.sys_clk_counter.count, on_change=False)
-            for i, kv in enumerate(self.bus.masters.items()):
-                k, v = kv
-                self.submodules += Monitor(
-                    f"%0d M[{i}] {k} adr: %0x cyc: %0b stb: %0b ack: %0b dat_w: %0x dat_r: %0x",
-                    cyc,
-                    v.adr * 4,
-                    v.cyc,
-                    v.stb,
-                    v.ack,
-                    v.dat_w,
-                    v.dat_r,
-                )
-            bus_wb32 = self.wb_reg32.bus
-            self.submodules += Monitor(
-                "%0d S32 adr: %0x cyc: %0b stb: %0b ack: %0b dat_w: %0x dat_r: %0x q: %0x",
-                cyc,
-                bus_wb32.adr * 4,
-                bus_wb32.cyc,
-                bus_wb32.stb,
-                bus_wb32.ack,
-                bus_wb32.dat_w,
-                bus_wb32.dat_r,
-                self.wb_reg32.q,
-            )
+            if not debug_soc_gen:
+                self.submodules.wb_reg_tester = WBRegisterTester(wb_reg32_base // 4)
+                self.bus.add_master("wb_reg_tester", self.wb_reg_tester.bus)
+
+            if with_monitors and not debug_soc_gen:
+                self.submodules.sys_clk_counter = Cycles()
+                cyc = MonitorArg(self.sys_clk_counter.count, on_change=False)
+                fmts, args = [], []
+                for i, (k, v) in enumerate(self.bus.masters.items()):
+                    fmts.append(
+                        f"M[{i}] {k} adr: %0x cyc: %0b stb: %0b ack: %0b dat_w: %0x dat_r: %0x"
+                    )
+                    args += [v.adr * 4, v.cyc, v.stb, v.ack, v.dat_w, v.dat_r]
+                bus_wb32 = self.wb_reg32.bus
+                fmts.append("S32 adr: %0x cyc: %0b stb: %0b ack: %0b dat_w: %0x dat_r: %0x q: %0x")
+                args += [
+                    bus_wb32.adr * 4,
+                    bus_wb32.cyc,
+                    bus_wb32.stb,
+                    bus_wb32.ack,
+                    bus_wb32.dat_w,
+                    bus_wb32.dat_r,
+                    self.wb_reg32.q,
+                ]
+                # One $monitor for the whole bus: a single print per change instead of one per port.
+                self.submodules += Monitor("%0d " + "\\n    ".join(fmts), cyc, *args)
             # self.bus.finalize()
             # decoder_master = self.bus._interconnect.decoder.master
             # decoder_slaves = self.bus._interconnect.decoder.slaves
@@ -393,27 +377,32 @@ class SimSoC(SoCCore):
             # )
 
         # scope ------------------------------------------------------------------------------------
-        if with_analyzer:
+        if with_analyzer and not debug_soc_gen:
+            from litescope import LiteScopeAnalyzer
+
             analyzer_signals = []
             if with_dram:
                 analyzer_signals += [
-                    ddr3_pads.a,
-                    ddr3_pads.ba,
                     ddr3_pads.cas_n,
                     ddr3_pads.ras_n,
                     ddr3_pads.we_n,
                     ddr3_pads.cs_n,
-                    ddr3_pads.dm,
-                    ddr3_pads.dq,
-                    # ddr3_pads.dqs_p,
                     self.ddr.init_state,
                     self.ddr.work_state,
-                    self.ddr.refresh_cnt,
                     self.ddr.refresh_issued,
-                    self.ddr.bus,
-                    self.ddr.sysio,
-                    self.bus.slaves["dram"],
                 ]
+                if analyzer_scope != "minimal":
+                    analyzer_signals += [
+                        ddr3_pads.a,
+                        ddr3_pads.ba,
+                        ddr3_pads.dq,
+                        # ddr3_pads.dqs_p,
+                        self.ddr.bus,
+                        self.ddr.sysio,
+                        self.bus.slaves["dram"],
+                    ]
+                if analyzer_scope == "full":
+                    analyzer_signals += [ddr3_pads.dm, self.ddr.refresh_cnt]
             # analyzer_signals = [phy_pads]
             if not with_dram:
                 # rev = reverse_signal(bus_master.adr)
@@ -424,16 +413,13 @@ class SimSoC(SoCCore):
                     self.wb_reg32.a,
                     self.wb_reg32.bus,
                     self.bus.slaves["wb_reg32"],
-                    self.wb_reg16.d,
-                    self.wb_reg16.q,
-                    self.wb_reg16.a,
-                    self.wb_reg16.bus,
-                    self.bus.slaves["wb_reg16"],
-                    bus_master,
+                    self.wb_reg_tester.bus,
                 ]
+            # The dram slave is the same Record as self.ddr.bus, don't capture it twice.
+            analyzer_signals = list({id(s): s for s in analyzer_signals}.values())
             self.submodules.analyzer = LiteScopeAnalyzer(
                 analyzer_signals,
-                depth=4096,
+                depth=analyzer_depth,
                 clock_domain="sys",
                 csr_csv="analyzer.csv",
             )
@@ -446,18 +432,32 @@ class SimSoC(SoCCore):
 def sim_args(parser):
     parser.add_argument("--debug-soc-gen", action="store_true", help="Don't run simulation")
     parser.add_argument("--with-analyzer", action="store_true", help="Use litescope")
+    parser.add_argument("--analyzer-depth", default=512, type=int, help="Litescope sample depth")
+    parser.add_argument(
+        "--analyzer-scope",
+        default="default",
+        choices=["minimal", "default", "full"],
+        help="DRAM signals to capture: control/FSM state only, plus buses, plus dm/refresh_cnt",
+    )
     parser.add_argument("--with-etherbone", action="store_true", help="Use Etherbone")
     parser.add_argument("--with-uartbone", action="store_true", help="Use UARTbone")
     parser.add_argument(
         "--with-dram", action="store_true", help="Use slowDDR3 controller and Micron model"
     )
+    parser.add_argument("--with-monitors", action="store_true", help="Print WB bus activity")
+    parser.add_argument(
+        "--trace-dram-init", action="store_true", help="Trace the DDR3 init sequence too"
+    )
 
 
 def main():
     from litex.soc.integration.soc import LiteXSoCArgumentParser
 
+    use_ccache()
+
     parser = LiteXSoCArgumentParser(description="litelitedram sim")
     parser.set_platform(SimPlatform)
+    parser.set_defaults(jobs=os.cpu_count(), threads=None, opt_level="O3", trace_fst=True)
     sim_args(parser)
     args = parser.parse_args()
 
@@ -477,28 +477,63 @@ def main():
     soc_kwargs["with_uart"] = False
     soc_kwargs["ident_version"] = True
 
-    soc = SimSoC(
-        with_analyzer=args.with_analyzer,
-        with_etherbone=args.with_etherbone,
-        with_uartbone=args.with_uartbone,
-        with_dram=args.with_dram,
-        trace=args.trace,
-        **soc_kwargs,
-    )
+    def make_soc():
+        return SimSoC(
+            with_analyzer=args.with_analyzer,
+            analyzer_depth=args.analyzer_depth,
+            analyzer_scope=args.analyzer_scope,
+            with_etherbone=args.with_etherbone,
+            with_uartbone=args.with_uartbone,
+            with_dram=args.with_dram,
+            with_monitors=args.with_monitors,
+            trace=args.trace,
+            trace_dram_init=args.trace_dram_init,
+            debug_soc_gen=args.debug_soc_gen,
+            **soc_kwargs,
+        )
+
+    if args.debug_soc_gen:
+        return make_soc()
 
     builder_argdict = parser.builder_argdict
     builder_argdict["csr_csv"] = "csr.csv"
-    builder_argdict["output_dir"] = soc.platform.output_dir
+    if builder_argdict["output_dir"] is None:
+        builder_argdict["output_dir"] = os.path.join("build", "sim")
 
     toolchain_argdict = parser.toolchain_argdict
     toolchain_argdict["regular_comb"] = False
+    if toolchain_argdict["threads"] is None:
+        # Only the DRAM model is big enough for Verilator's thread partitioning to pay off.
+        toolchain_argdict["threads"] = max(1, os.cpu_count() // 2) if args.with_dram else 1
 
-    if not args.debug_soc_gen:
+    def build(rtl_fresh=False):
+        soc = make_soc()
         builder = Builder(soc, **builder_argdict)
-        for i in range(2):
-            build = i == 0
-            run = i == 1 and builder.compile_gateware
-            builder.build(build=build, run=run, sim_config=sim_config, **toolchain_argdict)
+        builder.build(
+            build=not rtl_fresh,
+            run=builder.compile_gateware,
+            sim_config=sim_config,
+            **toolchain_argdict,
+        )
+        return soc
+
+    sources = [__file__, *package_sources()]
+    if args.with_dram:
+        # The controller and the Micron model are generated from the SlowDDR3 submodule.
+        sources += [*SlowDDR3.sources(), *DDR3Model.sources()]
+    artifacts = [os.path.join("gateware", "sim.v")]
+    compile_args = ("no_compile", "no_compile_software", "no_compile_gateware")
+    extra = (
+        sorted(soc_kwargs.items()),
+        sorted((k, v) for k, v in vars(args).items() if k not in compile_args),
+        sorted(toolchain_argdict.items()),
+        sim_config.modules,
+        os.environ.get("LITEX_NO_IDENT"),
+    )
+    if builder_argdict["compile_gateware"]:
+        artifacts.append(os.path.join("gateware", "obj_dir", "Vsim"))
+        return stamped_build(build, builder_argdict["output_dir"], sources, extra, artifacts)
+    return cached_build(build, builder_argdict["output_dir"], sources, extra, artifacts)
 
 
 if __name__ == "__main__":
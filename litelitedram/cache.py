@@ -0,0 +1,109 @@
+import glob
+import hashlib
+import os
+import shutil
+from functools import lru_cache
+from importlib.util import find_spec
+
+ELAB_CACHE_DIR = os.path.join("build", ".elab_cache")
+_STAMP_FILE = ".elab_stamp"
+_LIBRARIES = ("migen", "litex", "litex_boards", "litescope", "liteeth")
+
+
+def _cache_disabled():
+    return bool(os.environ.get("LITELITEDRAM_NO_CACHE"))
+
+
+@lru_cache(maxsize=None)
+def _libraries_state():
+    # Editable and forked checkouts keep their version, so key on the installed files themselves.
+    state = []
+    for name in _LIBRARIES:
+        spec = find_spec(name)
+        if spec is None:
+            state.append((name, None))
+            continue
+        for root in spec.submodule_search_locations or [os.path.dirname(spec.origin)]:
+            for dirpath, dirs, files in os.walk(root):
+                dirs[:] = [d for d in dirs if d != "__pycache__"]
+                for f in files:
+                    st = os.stat(os.path.join(dirpath, f))
+                    state.append((os.path.join(dirpath, f), st.st_mtime_ns, st.st_size))
+    return tuple(sorted(state, key=repr))
+
+
+def _cache_digest(paths, extra):
+    return inputs_digest(paths, (*extra, _libraries_state()))
+
+
+def inputs_digest(paths, extra=()):
+    h = hashlib.blake2b(digest_size=16)
+    for path in sorted(os.fspath(p) for p in paths):
+        h.update(path.encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    for e in extra:
+        h.update(repr(e).encode())
+    return h.hexdigest()
+
+
+def package_sources():
+    return glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))
+
+
+def read_stamp(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def use_ccache():
+    if shutil.which("ccache") is None:
+        return
+    # Verilator prefixes its C++ compiler invocations with $OBJCACHE.
+    os.environ.setdefault("OBJCACHE", "ccache")
+    os.environ.setdefault("CCACHE_DIR", os.path.expanduser("~/.cache/litex-ccache"))
+    os.environ.setdefault("CCACHE_SLOPPINESS", "time_macros,file_macro")
+
+
+def cached_convert(convert, paths, extra=(), cache_dir=ELAB_CACHE_DIR):
+    digest = _cache_digest(paths, extra)
+    cache_path = os.path.join(cache_dir, f"{digest}.v")
+    if not _cache_disabled() and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return f.read()
+    verilog = str(convert())
+    write_atomic(cache_path, verilog)
+    return verilog
+
+
+def _is_fresh(output_dir, digest, artifacts):
+    if _cache_disabled() or read_stamp(os.path.join(output_dir, _STAMP_FILE)) != digest:
+        return False
+    return all(os.path.exists(os.path.join(output_dir, a)) for a in artifacts)
+
+
+def cached_build(build, output_dir, paths, extra=(), artifacts=()):
+    digest = _cache_digest(paths, extra)
+    if _is_fresh(output_dir, digest, artifacts):
+        return None
+    result = build()
+    write_atomic(os.path.join(output_dir, _STAMP_FILE), digest)
+    return result
+
+
+def stamped_build(build, output_dir, paths, extra=(), artifacts=()):
+    digest = _cache_digest(paths, extra)
+    result = build(_is_fresh(output_dir, digest, artifacts))
+    write_atomic(os.path.join(output_dir, _STAMP_FILE), digest)
+    return result
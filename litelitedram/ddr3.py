@@ -1,12 +1,20 @@
 import os
+import re
+import shutil
 import subprocess
 from enum import IntEnum
+from functools import lru_cache
 from math import ceil, log2
+from pathlib import Path
 
 from litex.soc.interconnect import wishbone
 from migen import *
 from migen.genlib.record import DIR_M_TO_S, DIR_S_TO_M
 
+from litelitedram.cache import inputs_digest, read_stamp, write_atomic
+
+SLOWDDR3_DIR = (Path(__file__).parent.parent / "3rdparty" / "General-Slow-DDR3-Interface").resolve()
+
 _kbit = 1024
 _mbit = _kbit * 1024
 _gbit = _mbit * 1024
@@ -30,21 +38,24 @@ class WorkState(IntEnum):
     REFRESH = 3
 
 
+@lru_cache(maxsize=None)
+def _sysio_layout(width, bitsize):
+    return (
+        ("rd_valid", 1, DIR_S_TO_M),
+        ("rd_ready", 1, DIR_M_TO_S),
+        ("rd_data", width, DIR_S_TO_M),
+        ("wr_valid", 1, DIR_M_TO_S),
+        ("wr_ready", 1, DIR_S_TO_M),
+        ("wr_data", width, DIR_M_TO_S),
+        ("addr", ceil(log2(bitsize // width)), DIR_M_TO_S),
+        ("sel", width // 8, DIR_M_TO_S),
+        ("initfin", 1, DIR_S_TO_M),
+    )
+
+
 class SlowDDR3SysInterface(Record):
     def __init__(self, width, bitsize):
-        super().__init__(
-            [
-                ("rd_valid", 1, DIR_S_TO_M),
-                ("rd_ready", 1, DIR_M_TO_S),
-                ("rd_data", width, DIR_S_TO_M),
-                ("wr_valid", 1, DIR_M_TO_S),
-                ("wr_ready", 1, DIR_S_TO_M),
-                ("wr_data", width, DIR_M_TO_S),
-                ("addr", ceil(log2(bitsize // width)), DIR_M_TO_S),
-                ("sel", width // 8, DIR_M_TO_S),
-                ("initfin", 1, DIR_S_TO_M),
-            ]
-        )
+        super().__init__(_sysio_layout(width, bitsize))
 
 
 class SlowDDR3(Module):
@@ -89,12 +100,7 @@ class SlowDDR3(Module):
             self.refresh_issued = Signal()
 
         cs, cas, ras, we = [Signal() for i in range(4)]
-        self.comb += [
-            pads.cs_n.eq(~cs),
-            pads.cas_n.eq(~cas),
-            pads.ras_n.eq(~ras),
-            pads.we_n.eq(~we),
-        ]
+        self.comb += Cat(pads.cs_n, pads.cas_n, pads.ras_n, pads.we_n).eq(~Cat(cs, cas, ras, we))
         dq = TSTriple(16)
         dqs_p = TSTriple(2)
         dqs_n = TSTriple(2)
@@ -139,45 +145,76 @@ class SlowDDR3(Module):
         )
         if debug:
             ports.update(
-                dict(
-                    o_phyIO_init_state=self.init_state,
-                    o_phyIO_work_state=self.work_state,
-                    o_phyIO_refresh_cnt=self.refresh_cnt,
-                    o_phyIO_refresh_issued=self.refresh_issued,
-                )
+                o_phyIO_init_state=self.init_state,
+                o_phyIO_work_state=self.work_state,
+                o_phyIO_refresh_cnt=self.refresh_cnt,
+                o_phyIO_refresh_issued=self.refresh_issued,
             )
 
         self.specials += Instance("slowDDR3", name="slowDDR3_ctlr", **ports)
 
     @staticmethod
-    def _needs_rebuild(target, dependencies):
-        if not os.path.exists(target):
-            return True
-        tgt_mtime = os.path.getmtime(target)
-        for dep in dependencies:
-            if os.path.getmtime(dep) > tgt_mtime:
-                return True
-        return False
+    def _sbt_launcher():
+        # Thin clients talk to a long-lived sbt server, so the JVM and Scala compiler stay warm.
+        if not os.environ.get("LITEDRAM_SBT_CLIENT"):
+            return ["sbt"]
+        if shutil.which("sbtn") is not None:
+            return ["sbtn"]
+        return ["sbt", "--client"]
+
+    @staticmethod
+    def _trace_top_only(verilog_path, top):
+        # The debug ports already export the controller state, don't dump every submodule wire.
+        def mark(m):
+            pragma = "tracing_on" if m.group(1) == top else "tracing_off"
+            return f"/*verilator {pragma}*/\n{m.group(0)}"
+
+        with open(verilog_path) as f:
+            verilog = f.read()
+        write_atomic(verilog_path, re.sub(r"^module\s+(\w+)", mark, verilog, flags=re.MULTILINE))
+
+    @staticmethod
+    def _sbt_sources(sbt_dir):
+        for root, dirs, files in os.walk(sbt_dir):
+            dirs[:] = [d for d in dirs if d not in ("target", ".bsp", ".git")]
+            for f in files:
+                if f.endswith((".scala", ".sbt")):
+                    yield os.path.join(root, f)
+
+    @classmethod
+    def sources(cls):
+        return list(cls._sbt_sources(SLOWDDR3_DIR))
 
     def do_finalize(self):
         verilog_dir = os.path.join(self.platform.output_dir, "gateware")
         verilog_file = f"slowDDR3_{self.sys_clk_freq}_clk.v"
         verilog_path = os.path.join(verilog_dir, verilog_file)
-        sbt_dir = os.path.normpath(
-            os.path.join(os.path.dirname(__file__), "..", "3rdparty", "General-Slow-DDR3-Interface")
-        )
-        scala_file = os.path.join(sbt_dir, "slowDDR3.scala")
-        dbg = ""
+        sbt_dir = SLOWDDR3_DIR
+        # fmt: off
+        run_args = [
+            "--odir", verilog_dir,
+            "--filename", verilog_file,
+            "--sys-clk", str(self.sys_clk_freq),
+            "--tristate", "true",
+        ]
+        # fmt: on
         if self.debug:
-            dbg = " --debug true"
-
-        if self._needs_rebuild(verilog_path, [scala_file]):
-            subprocess.check_call(
-                [
-                    "sbt",
-                    f"run --odir {verilog_dir} --filename {verilog_file} --sys-clk {self.sys_clk_freq} --tristate true"
-                    + dbg,
-                ],
-                cwd=sbt_dir,
-            )
+            run_args += ["--debug", "true"]
+        # sbt takes whole commands as arguments, so `run` and its options must stay one token.
+        # Its parser only understands double quotes, so quote each option that way.
+        quoted = ('"' + a.replace("\\", "\\\\").replace('"', '\\"') + '"' for a in run_args)
+        sbt_cmd = " ".join(["run", *quoted])
+
+        stamp_path = verilog_path + ".stamp"
+        digest = inputs_digest(self._sbt_sources(sbt_dir), extra=(sbt_cmd,))
+        if not os.path.exists(verilog_path) or read_stamp(stamp_path) != digest:
+            subprocess.check_call([*self._sbt_launcher(), sbt_cmd], cwd=sbt_dir)
+            if self.debug:
+                self._trace_top_only(verilog_path, "slowDDR3")
+            write_atomic(stamp_path, digest)
         self.platform.add_source(verilog_path)
+
+
+class SlowDDR3BlackBox(SlowDDR3):
+    def do_finalize(self):
+        pass
@@ -1,54 +1,62 @@
 import subprocess
-from pathlib import Path
+from functools import lru_cache
 
 from migen import *
 from migen.genlib.record import DIR_M_TO_S, DIR_NONE
 
+from litelitedram.ddr3 import SLOWDDR3_DIR
+
+
+@lru_cache(maxsize=None)
+def _phy_layout(row_width, dq_width):
+    return (
+        ("a", row_width, DIR_M_TO_S),
+        ("ba", 3, DIR_M_TO_S),
+        ("ras_n", 1, DIR_M_TO_S),
+        ("cas_n", 1, DIR_M_TO_S),
+        ("we_n", 1, DIR_M_TO_S),
+        ("dm", dq_width // 8, DIR_M_TO_S),
+        ("dq", dq_width, DIR_NONE),
+        ("dqs_p", dq_width // 8, DIR_NONE),
+        ("dqs_n", dq_width // 8, DIR_NONE),
+        ("clk_p", 1, DIR_M_TO_S),
+        ("clk_n", 1, DIR_M_TO_S),
+        ("cs_n", 1, DIR_M_TO_S),
+        ("cke", 1, DIR_M_TO_S),
+        ("odt", 1, DIR_M_TO_S),
+        ("reset_n", 1, DIR_M_TO_S),
+    )
+
+
+@lru_cache(maxsize=None)
+def _model_layout(row_width, dq_width):
+    return (
+        ("addr", row_width, DIR_M_TO_S),
+        ("ba", 3, DIR_M_TO_S),
+        ("ras_n", 1, DIR_M_TO_S),
+        ("cas_n", 1, DIR_M_TO_S),
+        ("we_n", 1, DIR_M_TO_S),
+        ("dm_tdqs", dq_width // 8, DIR_M_TO_S),
+        ("dq", dq_width, DIR_NONE),
+        ("dqs", dq_width // 8, DIR_NONE),
+        ("dqs_n", dq_width // 8, DIR_NONE),
+        ("ck", 1, DIR_M_TO_S),
+        ("ck_n", 1, DIR_M_TO_S),
+        ("cs_n", 1, DIR_M_TO_S),
+        ("cke", 1, DIR_M_TO_S),
+        ("odt", 1, DIR_M_TO_S),
+        ("rst_n", 1, DIR_M_TO_S),
+    )
+
 
 class DDR3PhyInterface(Record):
     def __init__(self, row_width=14, dq_width=16):
-        super().__init__(
-            [
-                ("a", row_width, DIR_M_TO_S),
-                ("ba", 3, DIR_M_TO_S),
-                ("ras_n", 1, DIR_M_TO_S),
-                ("cas_n", 1, DIR_M_TO_S),
-                ("we_n", 1, DIR_M_TO_S),
-                ("dm", dq_width // 8, DIR_M_TO_S),
-                ("dq", dq_width, DIR_NONE),
-                ("dqs_p", dq_width // 8, DIR_NONE),
-                ("dqs_n", dq_width // 8, DIR_NONE),
-                ("clk_p", 1, DIR_M_TO_S),
-                ("clk_n", 1, DIR_M_TO_S),
-                ("cs_n", 1, DIR_M_TO_S),
-                ("cke", 1, DIR_M_TO_S),
-                ("odt", 1, DIR_M_TO_S),
-                ("reset_n", 1, DIR_M_TO_S),
-            ]
-        )
+        super().__init__(_phy_layout(row_width, dq_width))
 
 
 class DDR3ModelInterface(Record):
     def __init__(self, row_width, dq_width):
-        super().__init__(
-            [
-                ("addr", row_width, DIR_M_TO_S),
-                ("ba", 3, DIR_M_TO_S),
-                ("ras_n", 1, DIR_M_TO_S),
-                ("cas_n", 1, DIR_M_TO_S),
-                ("we_n", 1, DIR_M_TO_S),
-                ("dm_tdqs", dq_width // 8, DIR_M_TO_S),
-                ("dq", dq_width, DIR_NONE),
-                ("dqs", dq_width // 8, DIR_NONE),
-                ("dqs_n", dq_width // 8, DIR_NONE),
-                ("ck", 1, DIR_M_TO_S),
-                ("ck_n", 1, DIR_M_TO_S),
-                ("cs_n", 1, DIR_M_TO_S),
-                ("cke", 1, DIR_M_TO_S),
-                ("odt", 1, DIR_M_TO_S),
-                ("rst_n", 1, DIR_M_TO_S),
-            ]
-        )
+        super().__init__(_model_layout(row_width, dq_width))
 
 
 class DDR3Model(Module):
@@ -73,10 +81,17 @@ class DDR3Model(Module):
         )
         self.specials += Instance("ddr3", name="ddr3_model", **ports)
 
+    @staticmethod
+    def sources():
+        # Only checked-in files: make writes ddr3.v and friends into model/ during elaboration.
+        tracked = subprocess.check_output(["git", "ls-files", "-z", "model"], cwd=SLOWDDR3_DIR)
+        return [
+            SLOWDDR3_DIR / "Makefile",
+            *(SLOWDDR3_DIR / p for p in tracked.decode().split("\0") if p),
+        ]
+
     def do_finalize(self):
-        slowddr3_dir = (
-            Path(__file__).parent.parent / "3rdparty" / "General-Slow-DDR3-Interface"
-        ).resolve()
+        slowddr3_dir = SLOWDDR3_DIR
         ddr3_model_dir = slowddr3_dir / "model"
         ddr3_model_file = ddr3_model_dir / "ddr3.v"
         subprocess.check_call(["make", "model/ddr3.v"], cwd=slowddr3_dir)
@@ -1,5 +1,3 @@
-from collections import abc
-
 from migen.fhdl.module import Module
 from migen.fhdl.structure import Cat, Signal
 from migen.genlib.record import Record
@@ -16,97 +14,113 @@ def is_builtin_type(obj):
 # fmt: on
 
 
+_SCALAR_TYPES = (bool, complex, float, int, type)
+_RAW_SEQUENCE_TYPES = (bytearray, bytes, range, str, memoryview)
+_LEAF_TYPES = _SCALAR_TYPES + _RAW_SEQUENCE_TYPES
+
+
 def is_builtin_scalar(obj):
-    return isinstance(obj, (bool, complex, float, int, type))
+    return isinstance(obj, _SCALAR_TYPES)
 
 
 def is_raw_sequence(obj):
-    return isinstance(obj, (bytearray, bytes, range, str, memoryview))
+    return isinstance(obj, _RAW_SEQUENCE_TYPES)
 
 
 def non_builtin_attrs(obj):
     return [a for a in dir(obj) if not is_attr_builtin(a)]
 
 
-def get_signals(obj, recurse=False, stack=None):
-    if stack is None:
-        stack = set()
-    if id(obj) in stack:
-        return set()
-    if is_builtin_scalar(obj) or is_raw_sequence(obj):
-        return set()
+def _attr_items(obj):
+    # Same test as is_attr_builtin, inlined since this runs for every attribute of every object.
+    return [(n, getattr(obj, n)) for n in dir(obj) if not (n[:2] == "__" == n[-2:])]
+
+
+def get_signals(obj, recurse=False):
     signals = set()
-    for attr_name in dir(obj):
-        if is_attr_builtin(attr_name):
+    # Maps id() to the object itself so nothing visited is freed and its id reused mid-walk.
+    visited = {}
+    todo = [obj]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in visited or isinstance(obj, _LEAF_TYPES):
             continue
-        attr = getattr(obj, attr_name)
-        if isinstance(attr, Signal):
-            signals.add(attr)
-        elif isinstance(attr, Record):
-            print(f"record: {migen_obj_name(attr)} layout:")
-            print(attr.layout)
-            assert False
-            for robj in attr.flatten():
-                signals.add(robj)
-        elif recurse:
-            if isinstance(attr, abc.Mapping):
-                for v in attr.values():
-                    signals |= get_signals(v, recurse=True, stack=stack | set([id(obj), id(attr)]))
-            elif isinstance(attr, abc.Sequence):
-                for v in attr:
-                    signals |= get_signals(v, recurse=True, stack=stack | set([id(obj), id(attr)]))
-            else:
-                signals |= get_signals(attr, recurse=True, stack=stack | set([id(obj), id(attr)]))
+        visited[id(obj)] = obj
+        for attr_name, attr in _attr_items(obj):
+            if isinstance(attr, Signal):
+                signals.add(attr)
+            elif isinstance(attr, Record):
+                signals.update(s for s in attr.flatten() if isinstance(s, Signal))
+            elif recurse:
+                if isinstance(attr, dict):
+                    visited[id(attr)] = attr
+                    todo.extend(attr.values())
+                elif isinstance(attr, (list, tuple)):
+                    visited[id(attr)] = attr
+                    todo.extend(attr)
     return signals
 
 
-def get_signals_tree(obj, stack=None):
-    if stack is None:
-        stack = set()
-    if id(obj) in stack:
-        return {}
-    if is_builtin_scalar(obj) or is_raw_sequence(obj):
-        return {}
+def get_signals_tree(obj):
+    path = set()
+    # id() -> (obj, tree), only for subtrees whose walk cut no cycle: those are path-independent.
+    memo = {}
+    cuts = 0
+
+    def walk(obj):
+        nonlocal cuts
+        if isinstance(obj, _LEAF_TYPES):
+            return {}
+        if id(obj) in memo:
+            return memo[id(obj)][1]
+        if id(obj) in path:
+            cuts += 1
+            return {}
+        path.add(id(obj))
+        cuts_before = cuts
+        try:
+            tree = _get_signals_tree(obj, walk)
+        finally:
+            path.discard(id(obj))
+        if cuts == cuts_before:
+            memo[id(obj)] = (obj, tree)
+        return tree
+
+    return walk(obj)
+
+
+def _get_signals_tree(obj, walk):
     signals = {}
-    to_inspect = {}
-    for attr_name in dir(obj):
-        to_inspect[attr_name] = getattr(obj, attr_name)
-    for attr_name in dir(obj):
-        if is_attr_builtin(attr_name):
-            continue
-        attr = getattr(obj, attr_name)
-        key = f"{attr_name}"
+    obj_is_module = isinstance(obj, Module)
+    for attr_name, attr in _attr_items(obj):
+        key = attr_name
         if isinstance(attr, Signal):
             signals[key] = attr
         elif isinstance(attr, Record):
+            fields = attr.__dict__
             for sig_tup in attr.layout:
                 name = sig_tup[0]
-                sub_signal = getattr(attr, name)
-                signals[f"{key}.{name}"] = sub_signal
-        elif isinstance(obj, Module) and attr_name == "_submodules":
+                signals[f"{key}.{name}"] = fields[name]
+        elif obj_is_module and attr_name == "_submodules":
             for i, sm in enumerate(attr):
                 name = f"sm_{type(sm[1]).__name__}_{i}" if sm[0] is None else sm[0]
-                sub_signals = get_signals_tree(sm[1], stack=stack | set([id(obj), id(attr)]))
+                sub_signals = walk(sm[1])
                 if len(sub_signals):
                     signals[f"submodules.{name}"] = sub_signals
-        if isinstance(attr, abc.Mapping):
+        elif isinstance(attr, dict):
             for k, v in attr.items():
                 subkey = f"{key}.{k}"
-                sub_signals = get_signals_tree(v, stack=stack | set([id(obj), id(attr)]))
+                sub_signals = walk(v)
                 if len(sub_signals):
                     signals[subkey] = sub_signals
-        elif isinstance(attr, abc.Sequence):
+        elif isinstance(attr, (list, tuple)):
             sub_signals = []
             for v in attr:
-                subsigs = get_signals_tree(v, stack=stack | set([id(obj), id(attr)]))
+                subsigs = walk(v)
                 if len(subsigs):
                     sub_signals.append(subsigs)
             if len(sub_signals):
                 signals[key] = sub_signals
-        else:
-            sub_signals = get_signals_tree(attr, stack=stack | set([id(obj), id(attr)]))
-            if len(sub_signals):
-                signals[key] = sub_signals
     return signals
 
 
@@ -126,3 +140,12 @@ def rename_migen_fsm(fsm, name):
     fsm.finalize()
     rename_migen_obj(fsm.state, f"{name}_state")
     rename_migen_obj(fsm.next_state, f"{name}_next_state")
+
+
+def fsm_edge_signals(fsm, state):
+    return (
+        fsm.before_entering(state),
+        fsm.after_entering(state),
+        fsm.before_leaving(state),
+        fsm.after_leaving(state),
+    )